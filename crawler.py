@@ -9,16 +9,23 @@ Bilibili 评论定时爬虫脚本
 """
 
 import asyncio
+import bisect
 import datetime
 import random
-import itertools
 import json
 import os
-from typing import List, Optional
+import time
+from typing import Dict, List, Optional
 
 from bilibili_api import video, comment, Credential
-from bilibili_api.exceptions import ResponseCodeException, ApiException
-from pymongo import MongoClient
+from bilibili_api.exceptions import ResponseCodeException, NetworkException, ApiException
+from pymongo import AsyncMongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+
+try:
+    import uvloop
+except ImportError:  # Windows 下不可用，回退到默认事件循环
+    uvloop = None
 
 
 # ==================== Configuration ====================
@@ -48,7 +55,7 @@ def get_config():
     }
 
 
-def get_cookie_pool(mongo_db, env_cookies: list) -> list:
+async def get_cookie_pool(mongo_db, env_cookies: list) -> list:
     """
     获取 Cookie 池
     优先使用环境变量中的 cookies，如果为空则从 MongoDB 的 cookie_pool 表获取
@@ -59,7 +66,9 @@ def get_cookie_pool(mongo_db, env_cookies: list) -> list:
     # 从 MongoDB 读取 Cookie 池
     try:
         cookie_coll = mongo_db["cookie_pool"]
-        cookies = list(cookie_coll.find({}))
+        cookies = await cookie_coll.find(
+            {}, {"sessdata": 1, "buvid3": 1, "bili_jct": 1, "_id": 0}
+        ).to_list()
         result = []
         for c in cookies:
             if c.get("sessdata"):
@@ -75,7 +84,7 @@ def get_cookie_pool(mongo_db, env_cookies: list) -> list:
         return []
 
 
-def get_monitor_list(mongo_db, env_bvid: str) -> list:
+async def get_monitor_list(mongo_db, env_bvid: str) -> list:
     """
     获取需要监控的视频配置列表
     优先从环境变量获取，如果为空则从 MongoDB 的 monitor_config 表获取
@@ -88,7 +97,9 @@ def get_monitor_list(mongo_db, env_bvid: str) -> list:
     # 从 MongoDB 读取监控列表
     try:
         config_coll = mongo_db["monitor_config"]
-        configs = list(config_coll.find({"enabled": True}))
+        configs = await config_coll.find(
+            {"enabled": True}, {"bvid": 1, "fetch_replies": 1, "_id": 0}
+        ).to_list()
         result = [{"bvid": c["bvid"], "fetch_replies": c.get("fetch_replies", False)} for c in configs if c.get("bvid")]
         print(f"✓ 从 MongoDB 读取到 {len(result)} 个监控视频")
         return result
@@ -99,6 +110,29 @@ def get_monitor_list(mongo_db, env_bvid: str) -> list:
 
 
 # ==================== Credential Pool ====================
+RATE_LIMIT_CODES = {-412, -352, -509}  # 风控 / 请求过于频繁
+RATE_LIMIT_STATUS = {412, 429}
+CREDENTIAL_ERROR_CODES = {-101, -111}  # 账号未登录 / csrf 校验失败
+COOLDOWN_BASE = 2.0     # 首次冷却秒数
+COOLDOWN_CAP = 300.0    # 冷却上限
+HEALTH_ALPHA = 0.2      # 成功率 EWMA 平滑系数
+HEALTH_FLOOR = 0.5      # 低于此值的账号仅在没有更健康账号时使用
+
+
+def is_rate_limited(e: Exception) -> bool:
+    """判断异常是否为风控 / 限流信号"""
+    if isinstance(e, ResponseCodeException):
+        return e.code in RATE_LIMIT_CODES
+    if isinstance(e, NetworkException):
+        return e.status in RATE_LIMIT_STATUS
+    return False
+
+
+def is_credential_error(e: Exception) -> bool:
+    """判断异常是否由账号本身引起（视频删除、评论关闭等不算）"""
+    return isinstance(e, ResponseCodeException) and e.code in CREDENTIAL_ERROR_CODES
+
+
 class CredentialPool:
     """凭证池管理类：处理多账号轮询和重试"""
     
@@ -112,27 +146,84 @@ class CredentialPool:
                     bili_jct=cfg.get("bili_jct", "")
                 )
             )
-        self.iterator = itertools.cycle(self.credentials)
+        self._idx = 0
         self.total = len(self.credentials)
+        self.slots = asyncio.Semaphore(max(self.total, 1))
+        # 以 id(cred) 为键的账号状态
+        self.cooldown_until: Dict[int, float] = {}
+        self.backoff: Dict[int, float] = {}
+        self.health: Dict[int, float] = {id(c): 1.0 for c in self.credentials}
         print(f"✓ 已加载 {self.total} 个账号")
 
-    def get_next(self) -> Credential:
+    def get_next(self) -> Optional[Credential]:
+        """轮询下一个可用账号，优先健康账号；全部冷却中时返回 None"""
         if not self.credentials:
             raise Exception("No credentials configured")
-        return next(self.iterator)
+        now = time.monotonic()
+        fallback = None
+        # 从游标处向后扫描，只有被选中的账号才推进游标，跳过的账号下次仍优先
+        for offset in range(self.total):
+            idx = (self._idx + offset) % self.total
+            key = id(self.credentials[idx])
+            if self.cooldown_until.get(key, 0) > now:
+                continue
+            if self.health[key] >= HEALTH_FLOOR:
+                fallback = idx
+                break
+            if fallback is None or self.health[key] > self.health[id(self.credentials[fallback])]:
+                fallback = idx
+        if fallback is None:
+            return None
+        self._idx = (fallback + 1) % self.total
+        return self.credentials[fallback]
+
+    async def acquire(self) -> Credential:
+        """获取可用账号，全部冷却中则等待最早结束的冷却"""
+        while True:
+            cred = self.get_next()
+            if cred is not None:
+                return cred
+            wait = min(self.cooldown_until.values()) - time.monotonic()
+            print(f"  ⏳ 所有账号冷却中，等待 {wait:.1f}s")
+            await asyncio.sleep(max(wait, 0))
+
+    def mark_success(self, cred: Credential):
+        key = id(cred)
+        self.health[key] += HEALTH_ALPHA * (1.0 - self.health[key])
+        self.backoff.pop(key, None)
+
+    def mark_failure(self, cred: Credential, rate_limited: bool = False):
+        key = id(cred)
+        self.health[key] -= HEALTH_ALPHA * self.health[key]
+        if rate_limited:
+            # decorrelated jitter: 在 [base, 上次冷却 * 3] 之间随机，封顶 COOLDOWN_CAP
+            prev = self.backoff.get(key, COOLDOWN_BASE)
+            delay = min(COOLDOWN_CAP, random.uniform(COOLDOWN_BASE, prev * 3))
+            self.backoff[key] = delay
+            self.cooldown_until[key] = time.monotonic() + delay
 
     async def execute_with_retry(self, func, *args, **kwargs):
-        """执行 API 函数，失败则切换账号重试"""
+        """执行 API 函数，失败则切换账号重试；风控账号进入指数冷却"""
         last_error = None
         for _ in range(self.total):
-            cred = self.get_next()
+            cred = await self.acquire()
             try:
                 kwargs['credential'] = cred
-                return await func(*args, **kwargs)
+                # 全局并发上限：所有视频、所有协程共享，只在请求在途时占用
+                async with self.slots:
+                    result = await func(*args, **kwargs)
+                self.mark_success(cred)
+                return result
             except (ResponseCodeException, ApiException) as e:
-                print(f"  ⚠ API 请求失败: {e}，切换账号重试...")
                 last_error = e
-                await asyncio.sleep(0.5)
+                if is_rate_limited(e):
+                    self.mark_failure(cred, rate_limited=True)
+                    print(f"  ⚠ 账号触发风控: {e}，冷却 {self.backoff[id(cred)]:.1f}s 后再用")
+                else:
+                    if is_credential_error(e):
+                        self.mark_failure(cred)
+                    print(f"  ⚠ API 请求失败: {e}，切换账号重试...")
+                    await asyncio.sleep(0.5)
             except Exception as e:
                 raise e
         
@@ -142,12 +233,34 @@ class CredentialPool:
 
 
 # ==================== MongoDB ====================
-def save_video_stats(mongo_db, bvid: str, video_info: dict, online: int = 0):
+BULK_WRITE_BATCH_SIZE = 1000  # 单次 bulk_write 的最大操作数
+
+# 本进程内已创建过 rpid 索引的 comments_{bvid} collection
+_ensured_indexes: set[str] = set()
+
+
+async def ensure_indexes(mongo_db):
+    """启动时创建固定 collection 的索引（comments_{bvid} 的索引按需创建一次）"""
+    try:
+        await mongo_db["video_stats"].create_index([("bvid", 1), ("timestamp", -1)])
+    except Exception as e:
+        print(f"⚠ 创建索引失败: {e}")
+
+
+async def ensure_comment_indexes(collection):
+    """为 comments_{bvid} 创建索引，每个 collection 在本进程内只创建一次"""
+    if collection.name in _ensured_indexes:
+        return
+    await collection.create_index("rpid", unique=True)
+    # 增量抓取按 root=0 查最大 rpid
+    await collection.create_index([("root", 1), ("rpid", -1)])
+    _ensured_indexes.add(collection.name)
+
+
+async def save_video_stats(mongo_db, bvid: str, video_info: dict, online: int = 0):
     """保存视频统计数据到 video_stats collection（用于趋势分析）"""
     try:
         stats_coll = mongo_db["video_stats"]
-        # 创建索引（仅首次）
-        stats_coll.create_index([("bvid", 1), ("timestamp", -1)])
         
         stat = video_info.get("stat", {})
         doc = {
@@ -162,67 +275,79 @@ def save_video_stats(mongo_db, bvid: str, video_info: dict, online: int = 0):
             "danmaku": stat.get("danmaku", 0), # 弹幕数
             "online": online,                   # 当前在线观看人数
         }
-        stats_coll.insert_one(doc)
-        print(f"✓ 已保存视频统计: 播放={doc['view']}, 点赞={doc['like']}, 在线={online}")
+        await stats_coll.insert_one(doc)
+        print(f"[{bvid}] ✓ 已保存视频统计: 播放={doc['view']}, 点赞={doc['like']}, 在线={online}")
     except Exception as e:
-        print(f"⚠ 保存视频统计失败: {e}")
+        print(f"[{bvid}] ⚠ 保存视频统计失败: {e}")
 
 
-def save_comments_to_mongodb(mongo_db, comments_data: list, bvid: str, oid: int, title: str = ""):
+def _comment_to_doc(c: dict, oid: int, bvid: str, fetched_at: datetime.datetime) -> dict:
+    """将 B 站评论转为数据库文档，嵌套字段只查找一次"""
+    member = c['member']
+    reply_control = c.get('reply_control')
+    fans_detail = member.get('fans_detail')
+    get = c.get
+    return {
+        "rpid": c['rpid'],
+        "oid": oid,
+        "bvid": bvid,
+        "user": member['uname'],
+        "mid": member['mid'],
+        "content": c['content']['message'],
+        "ctime": c['ctime'],
+        "sex": member.get('sex', '保密'),
+        "location": reply_control.get('location', '') if reply_control else "",
+        "level": member['level_info']['current_level'],
+        "likes": get('like', 0),
+        "rcount": get('rcount', 0),
+        "fans_medal": fans_detail.get('medal_name', '') if fans_detail else "",
+        "parent": get('parent', 0),
+        "root": get('root', 0),
+        "fetched_at": fetched_at
+    }
+
+
+async def save_comments_to_mongodb(mongo_db, comments_data: list, bvid: str, oid: int, title: str = ""):
     """保存评论到 MongoDB"""
     if not comments_data:
         return 0
     
     coll_name = f"comments_{bvid}"
     collection = mongo_db[coll_name]
-    collection.create_index("rpid", unique=True)
+    await ensure_comment_indexes(collection)
     
-    saved_count = 0
+    # 同一批次共用一个抓取时间，避免每条评论重复调用 utcnow()
+    fetched_at = datetime.datetime.utcnow()
+    ops = []
     for c in comments_data:
         try:
-            location = ""
-            if 'reply_control' in c and c['reply_control']:
-                location = c['reply_control'].get('location', '')
-            
-            fans_medal = ""
-            fans_detail = c['member'].get('fans_detail')
-            if fans_detail:
-                fans_medal = fans_detail.get('medal_name', '')
-            
-            doc = {
-                "rpid": c['rpid'],
-                "oid": oid,
-                "bvid": bvid,
-                "user": c['member']['uname'],
-                "mid": c['member']['mid'],
-                "content": c['content']['message'],
-                "ctime": c['ctime'],
-                "sex": c['member'].get('sex', '保密'),
-                "location": location,
-                "level": c['member']['level_info']['current_level'],
-                "likes": c.get('like', 0),
-                "rcount": c.get('rcount', 0),
-                "fans_medal": fans_medal,
-                "parent": c.get('parent', 0),
-                "root": c.get('root', 0),
-                "fetched_at": datetime.datetime.utcnow()
-            }
-            collection.update_one({"rpid": c['rpid']}, {"$set": doc}, upsert=True)
-            saved_count += 1
+            doc = _comment_to_doc(c, oid, bvid, fetched_at)
         except Exception as e:
             continue
+        ops.append(UpdateOne({"rpid": doc["rpid"]}, {"$set": doc}, upsert=True))
+    
+    # 批量写入，分批避免超过 16MB 命令上限
+    saved_count = 0
+    for i in range(0, len(ops), BULK_WRITE_BATCH_SIZE):
+        try:
+            result = await collection.bulk_write(ops[i:i + BULK_WRITE_BATCH_SIZE], ordered=False)
+            saved_count += result.upserted_count + result.modified_count
+        except BulkWriteError as e:
+            details = e.details
+            saved_count += details.get("nUpserted", 0) + details.get("nModified", 0)
+            print(f"  [{bvid}] ⚠ 批量写入部分失败: {len(details.get('writeErrors', []))} 条")
     
     # 更新视频元数据
     try:
         metadata_coll = mongo_db["video_metadata"]
-        metadata_coll.update_one(
+        await metadata_coll.update_one(
             {"bvid": bvid},
             {"$set": {
                 "bvid": bvid,
                 "oid": oid,
                 "title": title,
                 "last_updated": datetime.datetime.utcnow(),
-                "comment_count": collection.count_documents({}),
+                "comment_count": await collection.estimated_document_count(),
                 "collection_name": coll_name
             }},
             upsert=True
@@ -254,7 +379,7 @@ async def crawl_comments(bvid: str, pool: CredentialPool, mongo_db, fetch_replie
         info = await pool.execute_with_retry(get_video_info)
         oid = info['aid']
         title = info['title']
-        print(f"✓ 视频信息: {title} (OID={oid})")
+        print(f"[{bvid}] ✓ 视频信息: {title} (OID={oid})")
         
         # 获取当前在线观看人数
         online = 0
@@ -264,100 +389,136 @@ async def crawl_comments(bvid: str, pool: CredentialPool, mongo_db, fetch_replie
                 return await v.get_online()
             online_data = await pool.execute_with_retry(get_online)
             online = online_data.get('total', 0)
-            print(f"✓ 当前在线: {online} 人")
+            print(f"[{bvid}] ✓ 当前在线: {online} 人")
         except Exception as e:
-            print(f"⚠ 获取在线人数失败: {e}")
+            print(f"[{bvid}] ⚠ 获取在线人数失败: {e}")
         
         # 保存视频统计数据（趋势分析用）
-        save_video_stats(mongo_db, bvid, info, online)
+        await save_video_stats(mongo_db, bvid, info, online)
     except Exception as e:
-        print(f"✗ 获取视频信息失败: {e}")
+        print(f"[{bvid}] ✗ 获取视频信息失败: {e}")
         return
     
-    # 获取已存在的评论 ID 集合（用于增量抓取）
+    # 获取已存主评论的最大 rpid（用于增量抓取），走 (root, rpid) 索引，无需加载全部评论
+    # rpid 随时间递增，比它大的即为新评论；子评论可能晚于本次抓取的主评论写入，不参与比较
     coll_name = f"comments_{bvid}"
-    existing_rpids = set()
+    last_rpid = 0
     try:
         existing_coll = mongo_db[coll_name]
-        cursor = existing_coll.find({}, {"rpid": 1})
-        existing_rpids = {doc["rpid"] for doc in cursor}
-        print(f"✓ 数据库中已有 {len(existing_rpids)} 条评论")
+        await ensure_comment_indexes(existing_coll)
+        latest = await existing_coll.find_one({"root": 0}, {"rpid": 1, "_id": 0}, sort=[("rpid", -1)])
+        if latest:
+            last_rpid = latest["rpid"]
+        existing_count = await existing_coll.estimated_document_count()
+        print(f"[{bvid}] ✓ 数据库中已有 {existing_count} 条评论")
     except Exception:
         pass
     
-    # 2. 抓取主评论（增量模式：遇到旧评论停止）
-    all_replies = []
-    page = 1
-    max_pages = 100
-    found_existing = False
-    
-    print("\n📥 正在抓取主评论（增量模式）...")
-    while page <= max_pages:
-        try:
-            page_data = await pool.execute_with_retry(
-                comment.get_comments,
-                oid=oid,
-                type_=comment.CommentResourceType.VIDEO,
-                order=comment.OrderType.TIME,  # 按时间排序，便于增量抓取
-                page_index=page
-            )
-            
-            replies = page_data.get('replies') or []
-            page_info = page_data.get('page', {})
-            total_count = page_info.get('count', 0)
-            
-            if not replies:
+    # 保存任务：抓取到的评论经队列交给它写入 MongoDB，写库期间不阻塞下一次 API 请求
+    save_queue: asyncio.Queue = asyncio.Queue(maxsize=100)
+
+    async def saver():
+        # 出错后继续消费队列，避免生产者在队列满时卡死；结束时再抛出
+        saved = 0
+        error = None
+        done = False
+        while not done:
+            batch = await save_queue.get()
+            if batch is None:
                 break
-            
-            # 检查是否有已存在的评论
-            new_replies = []
-            for reply in replies:
-                if reply['rpid'] in existing_rpids:
-                    found_existing = True
+            # 合并队列中已积压的批次，一次 bulk_write + 一次元数据更新
+            batch = list(batch)
+            while not save_queue.empty():
+                more = save_queue.get_nowait()
+                if more is None:
+                    done = True
                     break
-                new_replies.append(reply)
-            
-            all_replies.extend(new_replies)
-            
-            if found_existing:
-                print(f"  第 {page} 页: 发现已存在评论，停止抓取 | 本次新增: {len(all_replies)} 条")
-                break
-            
-            print(f"  第 {page} 页: {len(new_replies)} 条 | 累计: {len(all_replies)}/{total_count}")
-            
-            if len(all_replies) >= total_count:
-                break
-            
-            page += 1
-            await asyncio.sleep(random.uniform(0.5, 1.5))
-            
-        except Exception as e:
-            print(f"  ⚠ 第 {page} 页抓取失败: {e}")
-            break
-    
-    if not found_existing and len(all_replies) > 0:
-        print(f"  ✓ 全部抓取完成，共 {len(all_replies)} 条新评论")
+                batch.extend(more)
+            try:
+                saved += await save_comments_to_mongodb(mongo_db, batch, bvid, oid, title)
+            except Exception as e:
+                print(f"  [{bvid}] ⚠ 保存评论失败: {e}")
+                error = e
+        if error:
+            raise error
+        return saved
+
+    saver_task = asyncio.create_task(saver())
     
-    # 3. 抓取子评论（如果启用）
-    sub_replies_count = 0
-    if fetch_replies:
-        print("\n📥 正在抓取子评论...")
+    # 抓取中途出错或被取消时，也要让保存任务写完已入队的评论并退出
+    try:
+        # 2. 抓取主评论（增量模式：遇到旧评论停止）
+        all_replies = []
+        page = 1
+        max_pages = 100
+        found_existing = False
+        
+        print(f"\n[{bvid}] 📥 正在抓取主评论（增量模式）...")
+        while page <= max_pages:
+            try:
+                page_data = await pool.execute_with_retry(
+                    comment.get_comments,
+                    oid=oid,
+                    type_=comment.CommentResourceType.VIDEO,
+                    order=comment.OrderType.TIME,  # 按时间排序，便于增量抓取
+                    page_index=page
+                )
+                
+                replies = page_data.get('replies') or []
+                page_info = page_data.get('page', {})
+                total_count = page_info.get('count', 0)
+                
+                if not replies:
+                    break
+                
+                # 按时间倒序，rpid 递减：二分定位第一条旧评论
+                cut = bisect.bisect_left(replies, -last_rpid, key=lambda r: -r['rpid'])
+                new_replies = replies[:cut]
+                found_existing = cut < len(replies)
+                
+                all_replies.extend(new_replies)
+                if new_replies:
+                    await save_queue.put(new_replies)
+                
+                if found_existing:
+                    print(f"  [{bvid}] 第 {page} 页: 发现已存在评论，停止抓取 | 本次新增: {len(all_replies)} 条")
+                    break
+                
+                print(f"  [{bvid}] 第 {page} 页: {len(new_replies)} 条 | 累计: {len(all_replies)}/{total_count}")
+                
+                if len(all_replies) >= total_count:
+                    break
+                
+                page += 1
+                await asyncio.sleep(random.uniform(0.5, 1.5))
+                
+            except Exception as e:
+                print(f"  [{bvid}] ⚠ 第 {page} 页抓取失败: {e}")
+                break
+        
+        if not found_existing and len(all_replies) > 0:
+            print(f"  [{bvid}] ✓ 全部抓取完成，共 {len(all_replies)} 条新评论")
         
-        for idx, top_comment in enumerate(all_replies[:]):
-            rcount = top_comment.get('rcount', 0)
-            if rcount > 0:
+        # 3. 抓取子评论（如果启用）
+        sub_replies_count = 0
+        if fetch_replies:
+            print(f"\n[{bvid}] 📥 正在抓取子评论...")
+            
+            async def fetch_sub(credential, oid, rpid, page_idx):
+                c = comment.Comment(
+                    oid=oid,
+                    type_=comment.CommentResourceType.VIDEO,
+                    rpid=rpid,
+                    credential=credential
+                )
+                return await c.get_sub_comments(page_index=page_idx, page_size=20)
+
+            # 并发上限由 CredentialPool 统一控制
+            async def fetch_one(top_comment):
+                fetched = 0
                 sub_page = 1
                 while True:
                     try:
-                        async def fetch_sub(credential, oid, rpid, page_idx):
-                            c = comment.Comment(
-                                oid=oid,
-                                type_=comment.CommentResourceType.VIDEO,
-                                rpid=rpid,
-                                credential=credential
-                            )
-                            return await c.get_sub_comments(page_index=page_idx, page_size=20)
-
                         sub_data = await pool.execute_with_retry(
                             fetch_sub,
                             oid=oid,
@@ -369,8 +530,8 @@ async def crawl_comments(bvid: str, pool: CredentialPool, mongo_db, fetch_replie
                         if not sub_list:
                             break
                         
-                        all_replies.extend(sub_list)
-                        sub_replies_count += len(sub_list)
+                        fetched += len(sub_list)
+                        await save_queue.put(sub_list)
                         
                         if len(sub_list) < 20:
                             break
@@ -378,52 +539,46 @@ async def crawl_comments(bvid: str, pool: CredentialPool, mongo_db, fetch_replie
                         await asyncio.sleep(0.1)
                     except Exception as e:
                         break
-        
-        print(f"  子评论: {sub_replies_count} 条")
-    else:
-        print("\n⏭️ 跳过子评论抓取")
-    
-    # 4. 保存到 MongoDB
-    print(f"\n💾 保存到 MongoDB...")
-    saved = save_comments_to_mongodb(mongo_db, all_replies, bvid, oid, title)
-    print(f"✓ 已保存 {saved} 条评论")
+                return fetched
+
+            targets = [c for c in all_replies if c.get('rcount', 0) > 0]
+            results = await asyncio.gather(*(fetch_one(t) for t in targets))
+            sub_replies_count = sum(results)
+            
+            print(f"  [{bvid}] 子评论: {sub_replies_count} 条")
+        else:
+            print(f"\n[{bvid}] ⏭️ 跳过子评论抓取")
+    finally:
+        # 4. 等待剩余评论写入 MongoDB
+        print(f"\n[{bvid}] 💾 保存到 MongoDB...")
+        await save_queue.put(None)
+        saved = await saver_task
+    print(f"[{bvid}] ✓ 已保存 {saved} 条评论")
     
     return saved
 
 
-async def main():
-    print("=" * 50)
-    print("🚀 Bilibili 评论定时爬虫")
-    print(f"⏰ 运行时间: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print("=" * 50)
-    
-    # 读取配置
-    try:
-        config = get_config()
-    except ValueError as e:
-        print(f"✗ 配置错误: {e}")
-        return
-    
-    # 连接 MongoDB
-    print("\n📦 连接 MongoDB...")
+async def run_crawler(mongo_client, config: dict):
+    """连接 MongoDB 后的主流程，由 main 负责关闭连接"""
+    mongo_db = mongo_client["bilibili_monitor"]
     try:
-        mongo_client = MongoClient(config["mongo_uri"])
-        mongo_db = mongo_client["bilibili_monitor"]
         # 测试连接
-        mongo_client.admin.command('ping')
+        await mongo_client.admin.command('ping')
         print("✓ MongoDB 连接成功")
     except Exception as e:
         print(f"✗ MongoDB 连接失败: {e}")
         return
     
+    await ensure_indexes(mongo_db)
+    
     # 获取 Cookie 池（优先环境变量，其次 MongoDB）
-    cookies = get_cookie_pool(mongo_db, config["cookies"])
+    cookies = await get_cookie_pool(mongo_db, config["cookies"])
     if not cookies:
         print("⚠ 没有可用的账号，请在 WebUI 中导入 Cookie 或设置 COOKIES_JSON 环境变量")
         return
     
     # 获取监控列表
-    monitor_list = get_monitor_list(mongo_db, config["bvid"])
+    monitor_list = await get_monitor_list(mongo_db, config["bvid"])
     
     if not monitor_list:
         print("⚠ 没有需要监控的视频，请在 WebUI 中添加")
@@ -434,24 +589,64 @@ async def main():
     # 初始化凭证池
     pool = CredentialPool(cookies)
     
-    # 逐个抓取
+    # 并发抓取：同时最多 pool.total 个视频，一个视频结束立即开始下一个
+    # 实际在途请求数由 CredentialPool 的全局并发上限约束
+    video_slots = asyncio.Semaphore(max(pool.total, 1))
+
+    async def crawl_one(i, video_config):
+        async with video_slots:
+            bvid = video_config["bvid"]
+            fetch_replies = video_config.get("fetch_replies", False)
+            print(f"\n{'─' * 40}")
+            print(f"[{i}/{len(monitor_list)}] 处理视频: {bvid} (抓取回复: {'是' if fetch_replies else '否'})")
+            return await crawl_comments(bvid, pool, mongo_db, fetch_replies=fetch_replies)
+
     total_saved = 0
-    for i, video_config in enumerate(monitor_list, 1):
-        bvid = video_config["bvid"]
-        fetch_replies = video_config.get("fetch_replies", False)
-        print(f"\n{'─' * 40}")
-        print(f"[{i}/{len(monitor_list)}] 处理视频: {bvid} (抓取回复: {'是' if fetch_replies else '否'})")
-        try:
-            saved = await crawl_comments(bvid, pool, mongo_db, fetch_replies=fetch_replies)
-            total_saved += saved or 0
-        except Exception as e:
-            print(f"✗ 抓取失败: {e}")
+    results = await asyncio.gather(
+        *(crawl_one(i, cfg) for i, cfg in enumerate(monitor_list, 1)),
+        return_exceptions=True
+    )
+    for video_config, result in zip(monitor_list, results):
+        if isinstance(result, Exception):
+            print(f"✗ 抓取失败 ({video_config['bvid']}): {result}")
+        else:
+            total_saved += result or 0
     
     print("\n" + "=" * 50)
     print(f"✅ 爬虫任务完成，共保存 {total_saved} 条评论")
     print("=" * 50)
 
 
+async def main():
+    print("=" * 50)
+    print("🚀 Bilibili 评论定时爬虫")
+    print(f"⏰ 运行时间: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 50)
+    
+    # 读取配置
+    try:
+        config = get_config()
+    except ValueError as e:
+        print(f"✗ 配置错误: {e}")
+        return
+    
+    # 连接 MongoDB
+    print("\n📦 连接 MongoDB...")
+    try:
+        mongo_client = AsyncMongoClient(config["mongo_uri"])
+    except Exception as e:
+        print(f"✗ MongoDB 连接失败: {e}")
+        return
+    
+    try:
+        await run_crawler(mongo_client, config)
+    finally:
+        await mongo_client.close()
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
 